@@ -1,11 +1,15 @@
 import asyncio
 import datetime
+import itertools
 import os
+from typing import Optional
 
 import aiohttp
 import numpy as np
+import orjson
 import pandas as pd
 import requests
+from aiolimiter import AsyncLimiter
 from tqdm.asyncio import tqdm
 
 ########################
@@ -15,8 +19,8 @@ from tqdm.asyncio import tqdm
 # Variables
 MESSARI_API_KEY = os.getenv("MESSARI_API_KEY")
 LOOKBACK_DAYS = 28  # Number of days to lookback for news and market data. Increase this to get more historical data.
-OUTPUT_FILEPATH = "output/data.csv"
-SEM_VALUE = 10
+OUTPUT_FILEPATH = "output/data.parquet"
+RATE_LIMIT = 10  # Max requests per second to the Messari API
 
 # Constants
 MESSARI_BASE_URL = "https://api.messari.io"
@@ -36,11 +40,11 @@ START_TIMESTAMP_MS = START_TIMESTAMP_S * 1000
 ########################
 async def fetch_single_news_page(
     session: aiohttp.ClientSession,
-    sem: asyncio.Semaphore,
+    limiter: AsyncLimiter,
     page: int,
     start_timestamp: int,
     end_timestamp: int,
-) -> pd.DataFrame:
+) -> list[dict]:
     """Fetches a single page of news from Messari API"""
     params = {
         "sort": 1,
@@ -50,59 +54,78 @@ async def fetch_single_news_page(
         "page": page,
     }
 
-    async with sem:
-        await asyncio.sleep(1)  # Rate limiting
+    async with limiter:
         async with session.get(
             NEWS_API_URL, headers=HEADERS, params=params
         ) as response:
-            return pd.DataFrame((await response.json())["data"])
+            return (await response.json(loads=orjson.loads))["data"]
 
 
 async def fetch_all_news_pages(
-    pages: list[int], sem_value: int, start_timestamp: int, end_timestamp: int
+    session: aiohttp.ClientSession,
+    limiter: AsyncLimiter,
+    pages: list[int],
+    start_timestamp: int,
+    end_timestamp: int,
+    asset_queue: Optional[asyncio.Queue] = None,
 ) -> pd.DataFrame:
-    """Fetches all news pages concurrently"""
-    sem = asyncio.Semaphore(sem_value)
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            fetch_single_news_page(session, sem, page, start_timestamp, end_timestamp)
-            for page in pages
-        ]
-        results = await tqdm.gather(*tasks, desc="Fetching news pages")
-    return pd.concat(results)
+    """Fetches all news pages concurrently, publishing asset ids as pages arrive"""
+
+    async def fetch_page(page: int) -> list[dict]:
+        records = await fetch_single_news_page(
+            session, limiter, page, start_timestamp, end_timestamp
+        )
+        if asset_queue is not None:
+            for record in records:
+                for asset in record.get("assets") or []:
+                    asset_queue.put_nowait(asset["id"])
+        return records
+
+    results = await tqdm.gather(
+        *[fetch_page(page) for page in pages], desc="Fetching news pages"
+    )
+    return pd.DataFrame(list(itertools.chain.from_iterable(results)))
 
 
 def process_news_data(
     news_df: pd.DataFrame,
-) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+) -> pd.DataFrame:
     """Process raw news data into required format"""
-    # Convert timestamp and clean unnecessary columns
-    news_df["date"] = pd.to_datetime(news_df["publishTimeMillis"], unit="ms").dt.date
+    # Convert timestamp to a day count since the epoch and clean unnecessary columns
+    news_df["date"] = (
+        news_df["publishTimeMillis"].to_numpy() // (SECONDS_IN_A_DAY * 1000)
+    ).astype(np.int32)
     news_df = news_df.drop(columns=["publishTimeMillis"])
 
     # Filter and process asset-related news
     news_df = news_df[news_df["assets"].notna()].explode("assets")
 
-    # Extract asset information
-    news_df["asset_id"] = news_df["assets"].apply(lambda x: x["id"])
-    news_df["asset_name"] = news_df["assets"].apply(lambda x: x["name"])
+    # Extract asset information in a single pass over the exploded dicts
+    assets = news_df["assets"].to_numpy()
+    news_df[["asset_id", "asset_name"]] = pd.DataFrame(
+        [(asset["id"], asset["name"]) for asset in assets],
+        columns=["asset_id", "asset_name"],
+        index=news_df.index,
+    )
     news_df = news_df.drop(columns=["assets"])
+    news_df["asset_id"] = news_df["asset_id"].astype("category")
 
     # Clean text fields
-    for col in ["title", "description", "url"]:
-        news_df[col] = news_df[col].fillna("None")
+    text_cols = ["title", "description", "url"]
+    news_df[text_cols] = news_df[text_cols].fillna("None")
 
     # Group by asset and date
-    grouped_df = news_df.groupby(["asset_id", "asset_name", "date"]).agg(
-        {"title": list, "description": list, "url": list}
-    )
-    grouped_df["count"] = grouped_df["title"].apply(len)
+    # Hash the group keys once and reuse the row positions for every text column
+    group_keys = ["asset_id", "asset_name", "date"]
+    group_indices = news_df.groupby(group_keys, sort=False, observed=True).indices
+    grouped_df = pd.DataFrame(list(group_indices.keys()), columns=group_keys)
+    grouped_df["asset_id"] = grouped_df["asset_id"].astype(news_df["asset_id"].dtype)
+    for col in text_cols:
+        values = news_df[col].to_numpy()
+        grouped_df[col] = [values[idx].tolist() for idx in group_indices.values()]
+    grouped_df["count"] = [len(idx) for idx in group_indices.values()]
 
-    return (
-        grouped_df.reset_index(),
-        news_df["asset_id"].unique(),
-        news_df["date"].unique(),
-    )
+    return grouped_df
 
 
 ########################
@@ -110,44 +133,58 @@ def process_news_data(
 ########################
 async def fetch_single_asset_market_data(
     session: aiohttp.ClientSession,
-    sem: asyncio.Semaphore,
+    limiter: AsyncLimiter,
     asset_id: str,
     start_timestamp: int,
     end_timestamp: int,
-) -> pd.DataFrame:
-    """Fetches market data for a single asset"""
+) -> tuple[str, np.ndarray, np.ndarray]:
+    """Fetches market data for a single asset as timestamp and close arrays"""
     url = f"{MARKET_DATA_BASE_API_URL}/{asset_id}/price/time-series"
     params = {"interval": "1d", "startTime": start_timestamp, "endTime": end_timestamp}
 
-    async with sem:
-        await asyncio.sleep(1)  # Rate limiting
+    async with limiter:
         async with session.get(url, headers=HEADERS, params=params) as response:
-            data = await response.json()
-            if not data:
-                return pd.DataFrame()
-
-            df = pd.DataFrame(data["data"])
-            df["asset_id"] = asset_id
-            return df
+            data = await response.json(loads=orjson.loads)
+            # Assets without prices come back empty or as {"data": null}
+            records = (data or {}).get("data") or []
+            timestamps = np.array([r["timestamp"] for r in records], dtype=np.int64)
+            closes = np.array([r["close"] for r in records], dtype=np.float64)
+            return asset_id, timestamps, closes
 
 
 async def fetch_all_market_data(
-    asset_ids: np.ndarray, sem_value: int, start_timestamp: int, end_timestamp: int
+    session: aiohttp.ClientSession,
+    limiter: AsyncLimiter,
+    asset_queue: asyncio.Queue,
+    start_timestamp: int,
+    end_timestamp: int,
 ) -> pd.DataFrame:
-    """Fetches market data for all assets concurrently"""
-    sem = asyncio.Semaphore(sem_value)
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            fetch_single_asset_market_data(
-                session, sem, asset_id, start_timestamp, end_timestamp
+    """Fetches market data for each new asset id on the queue until a None sentinel"""
+    seen_asset_ids = set()
+    tasks = []
+    with tqdm(desc="Fetching market data") as progress:
+        while (asset_id := await asset_queue.get()) is not None:
+            if asset_id in seen_asset_ids:
+                continue
+            seen_asset_ids.add(asset_id)
+            task = asyncio.create_task(
+                fetch_single_asset_market_data(
+                    session, limiter, asset_id, start_timestamp, end_timestamp
+                )
             )
-            for asset_id in asset_ids
-        ]
-        results = await tqdm.gather(*tasks, desc="Fetching market data")
-
-    df = pd.concat(results)
-    df["date"] = pd.to_datetime(df["timestamp"], unit="s").dt.date
-    return df[["date", "asset_id", "close"]]
+            task.add_done_callback(lambda _: progress.update())
+            tasks.append(task)
+        results = await asyncio.gather(*tasks)
+
+    asset_ids, timestamps, closes = zip(*results)
+    lengths = [len(ts) for ts in timestamps]
+    return pd.DataFrame(
+        {
+            "date": (np.concatenate(timestamps) // SECONDS_IN_A_DAY).astype(np.int32),
+            "asset_id": np.repeat(asset_ids, lengths),
+            "close": np.concatenate(closes),
+        }
+    )
 
 
 ########################
@@ -160,6 +197,38 @@ def ensure_output_directory(fp: str):
 ########################
 # 4. MAIN EXECUTION
 ########################
+async def fetch_all_data(total_pages: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Fetches news and market data concurrently over a single shared HTTP session"""
+    # Both endpoints count against the same API key, so they share one rate limiter
+    limiter = AsyncLimiter(max_rate=RATE_LIMIT, time_period=1)
+    connector = aiohttp.TCPConnector(limit=RATE_LIMIT, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # Start fetching market data as soon as news pages reveal asset ids
+        asset_queue = asyncio.Queue()
+        market_task = asyncio.create_task(
+            fetch_all_market_data(
+                session,
+                limiter,
+                asset_queue,
+                start_timestamp=START_TIMESTAMP_S,
+                end_timestamp=END_TIMESTAMP_S,
+            )
+        )
+        try:
+            news_df = await fetch_all_news_pages(
+                session,
+                limiter,
+                pages=range(1, total_pages + 1),
+                start_timestamp=START_TIMESTAMP_MS,
+                end_timestamp=END_TIMESTAMP_MS,
+                asset_queue=asset_queue,
+            )
+        finally:
+            asset_queue.put_nowait(None)
+
+        market_df = await market_task
+
+    return news_df, market_df
 
 
 def main():
@@ -178,33 +247,29 @@ def main():
     ).json()
     total_pages = response["metadata"]["totalPages"]
 
-    # Fetch and process all news
-    news_df = asyncio.run(
-        fetch_all_news_pages(
-            pages=range(1, total_pages + 1),
-            sem_value=SEM_VALUE,
-            start_timestamp=START_TIMESTAMP_MS,
-            end_timestamp=END_TIMESTAMP_MS,
-        )
-    )
-    processed_news_df, unique_asset_ids, unique_dates = process_news_data(news_df)
-
-    # 2. Fetch Market Data
-    market_df = asyncio.run(
-        fetch_all_market_data(
-            asset_ids=unique_asset_ids,
-            sem_value=SEM_VALUE,
-            start_timestamp=START_TIMESTAMP_S,
-            end_timestamp=END_TIMESTAMP_S,
-        )
-    )
+    # 2. Fetch News and Market Data
+    news_df, market_df = asyncio.run(fetch_all_data(total_pages))
+    processed_news_df = process_news_data(news_df)
 
     # 3. Merge and Export
+    # Share the news categories so the merge joins on integer codes
+    market_df["asset_id"] = market_df["asset_id"].astype(
+        processed_news_df["asset_id"].dtype
+    )
+    # Both sides are ordered by the join keys; each (asset_id, date) has one price
+    merge_keys = ["asset_id", "date"]
     final_df = pd.merge(
-        processed_news_df, market_df, on=["asset_id", "date"], how="left"
+        processed_news_df.sort_values(merge_keys),
+        market_df.sort_values(merge_keys),
+        on=merge_keys,
+        how="left",
+        validate="m:1",
+        sort=False,
     )
+    # Dates are joined as int32 day counts and only turned into datetimes here
+    final_df["date"] = pd.to_datetime(final_df["date"], unit="D")
     ensure_output_directory(OUTPUT_FILEPATH)
-    final_df.to_csv(OUTPUT_FILEPATH, index=False)
+    final_df.to_parquet(OUTPUT_FILEPATH, compression="zstd", index=False)
     print(f"Data exported to {OUTPUT_FILEPATH}")
 
 
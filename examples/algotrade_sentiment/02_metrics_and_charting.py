@@ -1,5 +1,11 @@
+import numpy as np
+import orjson
 import pandas as pd
 import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+from numba import njit, prange, types
 from plotly.subplots import make_subplots
 
 ########################
@@ -7,7 +13,7 @@ from plotly.subplots import make_subplots
 ########################
 
 # Variables
-INPUT_FILEPATH = "output/data.csv"
+INPUT_FILEPATH = "output/data.parquet"
 OUTPUT_METRICS_FILEPATH = "output/data_with_metrics.csv"
 OUTPUT_PLOT_FILEPATH = "output/momentum_vs_price.html"
 DEFAULT_ASSET_ID = "b3d5d66c-26a2-404c-9325-91dc714a722b"  # Solana
@@ -15,59 +21,167 @@ DEFAULT_ASSET_ID = "b3d5d66c-26a2-404c-9325-91dc714a722b"  # Solana
 # Constants
 ROLLING_WINDOW = 7  # Days for rolling average calculations
 MIN_PERIODS = 1  # Minimum periods for rolling calculations
+LIST_COLUMNS = ["title", "description", "url"]  # List-valued news columns
+
+
+# Compiled eagerly for this signature and cached to __pycache__ across runs.
+# Inputs are typed read-only so pandas' copy-on-write arrays are accepted as-is.
+READONLY_FLOAT_ARRAY = types.Array(types.float64, 1, "A", readonly=True)
+
+
+@njit(
+    types.void(
+        READONLY_FLOAT_ARRAY,
+        READONLY_FLOAT_ARRAY,
+        types.int64[:],
+        types.int64[:],
+        types.int64,
+        types.int64,
+        *[types.float64[:]] * 5,
+    ),
+    cache=True,
+    nogil=True,
+    parallel=True,
+    error_model="numpy",
+    fastmath={"reassoc", "contract"},
+)
+def compute_metrics_groups(
+    counts,
+    closes,
+    starts,
+    ends,
+    window,
+    min_periods,
+    count_7d_avg,
+    trend_score,
+    acceleration_score,
+    price_score,
+    momentum_score,
+):
+    """Compute every metric column in one pass over each contiguous asset block"""
+    # Forward-filled copies, matching pandas' default pct_change(fill_method="ffill")
+    filled_closes = np.empty(len(closes))
+    filled_trend = np.empty(len(closes))
+    for g in prange(len(starts)):
+        start, end = starts[g], ends[g]
+        acc = 0.0
+        for i in range(start, end):
+            # Rolling average count
+            acc += counts[i]
+            if i - start >= window:
+                acc -= counts[i - window]
+            n_obs = min(i - start + 1, window)
+            count_7d_avg[i] = acc / n_obs if n_obs >= min_periods else np.nan
+
+            # Carry the last known close forward within the asset
+            if np.isnan(closes[i]) and i > start:
+                filled_closes[i] = filled_closes[i - 1]
+            else:
+                filled_closes[i] = closes[i]
+
+            # Trend and price scores (`window`-day changes)
+            if i - start >= window:
+                trend_score[i] = count_7d_avg[i] / count_7d_avg[i - window] - 1.0
+                price_score[i] = filled_closes[i] / filled_closes[i - window] - 1.0
+            else:
+                trend_score[i] = np.nan
+                price_score[i] = np.nan
+
+            if np.isnan(trend_score[i]) and i > start:
+                filled_trend[i] = filled_trend[i - 1]
+            else:
+                filled_trend[i] = trend_score[i]
+
+            # Acceleration score (1-day change in trend)
+            if i - start >= 1:
+                acceleration_score[i] = filled_trend[i] / filled_trend[i - 1] - 1.0
+            else:
+                acceleration_score[i] = np.nan
+
+            momentum_score[i] = trend_score[i] * acceleration_score[i] * price_score[i]
+
+
+def get_group_bounds(asset_ids):
+    """Start/end row positions of each asset in a frame sorted by asset_id"""
+    codes, uniques = pd.factorize(asset_ids, sort=False)
+    starts = np.searchsorted(codes, np.arange(len(uniques)))
+    ends = np.append(starts[1:], len(codes))
+    return starts, ends
 
 
 def load_and_prepare_data():
-    """Load data from CSV and prepare initial dataframe"""
-    df = pd.read_csv(INPUT_FILEPATH)
-    df["date"] = pd.to_datetime(df["date"])
+    """Load data from Parquet and prepare initial dataframe"""
+    # Parquet keeps the datetime date and categorical asset_id dtypes
+    df = pd.read_parquet(INPUT_FILEPATH)
     return df.sort_values(["asset_id", "date"])
 
 
 def calculate_metrics(df):
     """Calculate momentum-related metrics for each asset"""
-    # Calculate rolling 7-day average count
-    df["count_7d_avg"] = df.groupby("asset_id")["count"].transform(
-        lambda x: x.rolling(window=ROLLING_WINDOW, min_periods=MIN_PERIODS).mean()
-    )
-
-    # Calculate trend score (7-day change in rolling average)
-    df["trend_score"] = df.groupby("asset_id")["count_7d_avg"].transform(
-        lambda x: x.pct_change(periods=ROLLING_WINDOW)
-    )
-
-    # Calculate acceleration score (1-day change in trend)
-    df["acceleration_score"] = df.groupby("asset_id")["trend_score"].transform(
-        lambda x: x.pct_change(periods=1)
-    )
-
-    # Calculate price score (7-day price change)
-    df["price_score"] = df.groupby("asset_id")["close"].transform(
-        lambda x: x.pct_change(periods=ROLLING_WINDOW)
+    # Rows are sorted by (asset_id, date), so each asset is a contiguous block
+    starts, ends = get_group_bounds(df["asset_id"])
+    metric_columns = [
+        "count_7d_avg",
+        "trend_score",
+        "acceleration_score",
+        "price_score",
+        "momentum_score",
+    ]
+    outputs = [np.empty(len(df)) for _ in metric_columns]
+
+    compute_metrics_groups(
+        df["count"].to_numpy(dtype=np.float64),
+        df["close"].to_numpy(dtype=np.float64),
+        starts,
+        ends,
+        ROLLING_WINDOW,
+        MIN_PERIODS,
+        *outputs,
     )
+    for column, values in zip(metric_columns, outputs):
+        df[column] = values
 
     return df
 
 
 def clean_data(df):
     """Clean data by handling infinities and filtering rows"""
-    # Replace infinities with NaN
-    for col in ["trend_score", "acceleration_score", "price_score"]:
-        df[col] = df[col].replace([float("inf"), float("-inf")], float("nan"))
-
-    # Remove rows with NaN values
-    df = df.dropna(subset=["close", "trend_score", "acceleration_score", "price_score"])
-
-    # Calculate and filter momentum score
-    df["momentum_score"] = (
-        df["trend_score"] * df["acceleration_score"] * df["price_score"]
+    trend = df["trend_score"].to_numpy()
+    acceleration = df["acceleration_score"].to_numpy()
+    price = df["price_score"].to_numpy()
+
+    # Keep rows with finite scores, a known close and positive momentum/acceleration
+    mask = (
+        np.isfinite(trend)
+        & np.isfinite(acceleration)
+        & np.isfinite(price)
+        & df["close"].notna().to_numpy()
+        & (df["momentum_score"].to_numpy() > 0)
+        & (acceleration > 0)
     )
-    df = df[df["momentum_score"] > 0]
-    df = df[df["acceleration_score"] > 0]
+    df = df.loc[mask]
 
     return df.sort_values(["date", "momentum_score"], ascending=[False, False])
 
 
+def export_csv(df, fp):
+    """Write dataframe to CSV with pyarrow's multi-threaded writer"""
+    # CSV has no list type, so serialize the news columns as JSON arrays
+    df = df.assign(
+        **{
+            col: df[col].map(lambda v: orjson.dumps(list(v)).decode())
+            for col in LIST_COLUMNS
+        }
+    )
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.set_column(
+        table.schema.get_field_index("date"),
+        "date",
+        pc.cast(table["date"], pa.date32()),
+    )
+    pacsv.write_csv(table, fp, write_options=pacsv.WriteOptions(batch_size=8192))
+
+
 def plot_momentum_vs_price(df, asset_id):
     """Create a dual-axis plot comparing momentum score and price"""
     # Filter for specific asset
@@ -79,7 +193,7 @@ def plot_momentum_vs_price(df, asset_id):
 
     # Add momentum score trace
     fig.add_trace(
-        go.Scatter(
+        go.Scattergl(
             x=asset_df["date"], y=asset_df["momentum_score"], name="Momentum Score"
         ),
         secondary_y=False,
@@ -87,7 +201,7 @@ def plot_momentum_vs_price(df, asset_id):
 
     # Add price trace
     fig.add_trace(
-        go.Scatter(x=asset_df["date"], y=asset_df["close"], name="Close Price"),
+        go.Scattergl(x=asset_df["date"], y=asset_df["close"], name="Close Price"),
         secondary_y=True,
     )
 
@@ -106,13 +220,18 @@ def main():
     df = clean_data(df)
 
     # Save processed data
-    df.to_csv(OUTPUT_METRICS_FILEPATH, index=False)
+    export_csv(df, OUTPUT_METRICS_FILEPATH)
     print(f"Processed data saved to {OUTPUT_METRICS_FILEPATH}")
 
     # Create and display plot
     fig = plot_momentum_vs_price(df, DEFAULT_ASSET_ID)
     # Save visualization
-    fig.write_html(OUTPUT_PLOT_FILEPATH)
+    fig.write_html(
+        OUTPUT_PLOT_FILEPATH,
+        include_plotlyjs="cdn",
+        include_mathjax=False,
+        full_html=True,
+    )
     fig.show()
 
 